@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+任务状态存储基准测试
+对比保存完整响应字典与JobStore的每任务内存占用和查询延迟
+"""
+
+import sys
+import time
+import random
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from luma_job_store import JobStore, JobStatus
+
+ARN_PREFIX = "arn:aws:bedrock:us-west-2:123456789012:async-invoke"
+OUTPUT_URI = "s3://s3-demo-zy/luma_test"
+BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+LOOKUPS = 100000
+
+
+def make_response(i: int) -> dict:
+    """生成与get_async_invoke返回结构一致的模拟响应"""
+    job_id = f"{i:012x}abcd"
+    roll = i % 10
+    status = "InProgress" if roll < 2 else ("Failed" if roll == 2 else "Completed")
+    submit_time = BASE_TIME + timedelta(seconds=i)
+    response = {
+        "ResponseMetadata": {
+            "RequestId": f"{i:08x}-0000-4000-8000-000000000000",
+            "HTTPStatusCode": 200,
+            "HTTPHeaders": {"content-type": "application/json", "content-length": "512"},
+            "RetryAttempts": 0,
+        },
+        "invocationArn": f"{ARN_PREFIX}/{job_id}",
+        "modelArn": "arn:aws:bedrock:us-west-2::foundation-model/luma.ray-v2:0",
+        "clientRequestToken": f"{i:032x}",
+        "status": status,
+        "submitTime": submit_time,
+        "lastModifiedTime": submit_time + timedelta(seconds=120),
+        "outputDataConfig": {"s3OutputDataConfig": {"s3Uri": f"{OUTPUT_URI}/{job_id}"}},
+    }
+    if status != "InProgress":
+        response["endTime"] = submit_time + timedelta(seconds=180)
+    if status == "Failed":
+        response["failureMessage"] = "Internal server error"
+    return response
+
+
+def measure(build) -> tuple:
+    """返回 (构建结果, 占用字节数)"""
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def bench(n: int, with_baseline: bool):
+    print(f"\n📊 {n:,} 个任务")
+
+    arns = [f"{ARN_PREFIX}/{i:012x}abcd" for i in range(n)]
+    probes = [random.choice(arns) for _ in range(LOOKUPS)]
+
+    if with_baseline:
+        def build_dicts():
+            return {r["invocationArn"]: r for r in map(make_response, range(n))}
+
+        responses, size = measure(build_dicts)
+        start = time.perf_counter()
+        for arn in probes:
+            responses[arn]["status"]
+        lookup = (time.perf_counter() - start) / LOOKUPS
+        start = time.perf_counter()
+        active = [arn for arn, r in responses.items() if r["status"] == "InProgress"]
+        scan = time.perf_counter() - start
+        print(f"  完整响应字典: {size / n:8.0f} 字节/任务, "
+              f"状态查询 {lookup * 1e9:6.0f} ns, 进行中任务(全量扫描) {scan * 1e3:8.1f} ms")
+        del responses, active
+
+    def build_store():
+        store = JobStore()
+        for i in range(n):
+            store.observe(make_response(i))
+        return store
+
+    store, size = measure(build_store)
+    start = time.perf_counter()
+    for arn in probes:
+        store.status(arn)
+    lookup = (time.perf_counter() - start) / LOOKUPS
+    start = time.perf_counter()
+    active = store.in_progress()
+    index = time.perf_counter() - start
+    since = BASE_TIME + timedelta(seconds=n - n // 100)
+    start = time.perf_counter()
+    failed = list(store.failed_since(since))
+    failed_query = time.perf_counter() - start
+    print(f"  JobStore:     {size / n:8.0f} 字节/任务, "
+          f"状态查询 {lookup * 1e9:6.0f} ns, 进行中任务(索引) {index * 1e3:8.1f} ms, "
+          f"最近1%失败任务 {failed_query * 1e3:.2f} ms")
+    assert len(active) == store.counts()["active"]
+    assert all(store.status(arn) == JobStatus.FAILED for arn in failed[:100])
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    random.seed(0)
+    for n in sizes:
+        # 百万级完整响应字典需要数GB内存，只测JobStore
+        bench(n, with_baseline=n <= 100000)
+
+
+if __name__ == "__main__":
+    main()
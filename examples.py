@@ -5,6 +5,7 @@ AWS Bedrock Luma Ray2 使用示例
 """
 
 from luma_ray2_client import LumaRay2Client
+from luma_sweep import SweepSpec, submit_sweep, ASPECT_RATIOS
 import logging
 from pathlib import Path
 
@@ -225,9 +226,43 @@ def simple_examples():
         print(f"❌ 获取任务列表失败: {e}")
 
 
+def sweep_examples():
+    """参数扫描示例"""
+    print("🎬 Luma Ray2 参数扫描示例")
+    print("=" * 50)
+    
+    client = LumaRay2Client()
+    output_path = "s3://s3-demo-zy/luma_test/"
+    
+    # 同一场景 × 7种宽高比 × 2种时长 × 2种分辨率 × 提示变体
+    spec = SweepSpec(
+        templates="A {animal} walking along {place} at golden hour, cinematic",
+        variables={
+            "animal": ["red fox", "snow leopard"],
+            "place": ["a misty forest trail", "a quiet beach"]
+        },
+        aspect_ratios=ASPECT_RATIOS,
+        durations=("5s", "9s"),
+        resolutions=("540p", "720p")
+    )
+    
+    # 启动前先估算费用
+    estimate = spec.estimate_cost()
+    print(f"📋 共 {estimate['jobs']} 个任务，计费 {estimate['billable_seconds']} 秒，预估 ${estimate['cost']:.2f}")
+    
+    for model_input, arn, error in submit_sweep(client, spec, output_path, max_in_flight=4):
+        if error:
+            print(f"❌ {model_input['aspect_ratio']} {model_input['duration']}: {error}")
+        else:
+            print(f"✅ {model_input['aspect_ratio']} {model_input['duration']}: {arn}")
+
+
 if __name__ == "__main__":
     # 运行完整示例
     main()
     
     # 或者运行简单示例
     # simple_examples()
+    
+    # 或者运行参数扫描示例
+    # sweep_examples()
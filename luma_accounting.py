@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Luma Ray2 费用与配额统计
+记录每个任务的计费单位、排队时间和生成时间，并预测并发配额何时饱和
+"""
+
+import math
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import deque, defaultdict
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每秒视频的单价（美元），按分辨率区分；以AWS官方定价页为准，可在构造时覆盖
+DEFAULT_PRICE_PER_SECOND = {
+    "540p": 0.75,
+    "720p": 1.50,
+}
+
+# 已结束的任务状态
+TERMINAL_STATUSES = ("Completed", "Failed")
+
+# 计算速率时观察时长的下限（秒），避免最初几个样本外推出过高的速率
+MIN_RATE_SPAN = 10.0
+
+
+def billable_seconds(duration: str) -> int:
+    """
+    将时长参数转换为计费秒数
+
+    Args:
+        duration: 视频时长 ("5s", "9s")
+
+    Returns:
+        计费秒数
+    """
+    return int(duration.rstrip("s"))
+
+
+def _to_epoch(value: Any) -> Optional[float]:
+    """将boto3返回的datetime（或时间戳）转换为epoch秒"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+class RollingWindow:
+    """
+    基于时间的滑动窗口
+
+    同时维护按时间排序的队列和按数值排序的列表，
+    过期淘汰与百分位查询都不需要对整个窗口重新排序。
+    """
+
+    def __init__(self, window_seconds: float = 3600, max_samples: int = 100000):
+        """
+        初始化滑动窗口
+
+        Args:
+            window_seconds: 窗口长度（秒）
+            max_samples: 窗口内最多保留的样本数
+        """
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self._samples = deque()  # (时间戳, 数值)
+        self._sorted = []
+        self._total = 0.0
+
+    def _evict(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._samples and (
+            self._samples[0][0] < cutoff or len(self._samples) > self.max_samples
+        ):
+            _, value = self._samples.popleft()
+            del self._sorted[bisect_left(self._sorted, value)]
+            self._total -= value
+
+    def add(self, value: float, now: Optional[float] = None):
+        """添加一个样本"""
+        now = time.time() if now is None else now
+        self._samples.append((now, value))
+        insort(self._sorted, value)
+        self._total += value
+        self._evict(now)
+
+    def count(self, now: Optional[float] = None) -> int:
+        """窗口内样本数"""
+        self._evict(time.time() if now is None else now)
+        return len(self._samples)
+
+    def mean(self, now: Optional[float] = None) -> Optional[float]:
+        """窗口内平均值，无样本时返回None"""
+        n = self.count(now)
+        return self._total / n if n else None
+
+    def percentile(self, p: float, now: Optional[float] = None) -> Optional[float]:
+        """
+        窗口内百分位数（最近秩法）
+
+        Args:
+            p: 百分位 (0-100)
+
+        Returns:
+            百分位数值，无样本时返回None
+        """
+        n = self.count(now)
+        if not n:
+            return None
+        rank = min(n - 1, max(0, math.ceil(p / 100.0 * n) - 1))
+        return self._sorted[rank]
+
+    def oldest(self, now: Optional[float] = None) -> Optional[float]:
+        """窗口内最早样本的时间戳，无样本时返回None"""
+        self._evict(time.time() if now is None else now)
+        return self._samples[0][0] if self._samples else None
+
+    def rate(self, now: Optional[float] = None, since: Optional[float] = None) -> float:
+        """
+        窗口内每秒样本数
+
+        Args:
+            now: 当前时间戳，默认为当前时间
+            since: 观察开始的时间戳（可选）。窗口尚未填满时按实际观察时长
+                计算速率（不短于MIN_RATE_SPAN秒），默认按整个窗口长度计算
+        """
+        now = time.time() if now is None else now
+        span = self.window_seconds
+        if since is not None:
+            span = min(span, max(now - since, MIN_RATE_SPAN))
+        return self.count(now) / span
+
+
+class UsageAccountant:
+    """
+    任务用量统计器
+
+    由LumaRay2Client在提交任务、查询状态和列出任务时调用，
+    所有方法都是线程安全的，可以在并发提交的工作线程中共享。
+
+    从未被查询到结束状态的任务（例如提交后不再轮询）会在stale_after秒后
+    移出进行中列表，也可以用reconcile()按服务端的进行中任务列表校正。
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 3600,
+        price_per_second: Optional[Dict[str, float]] = None,
+        stale_after: Optional[float] = 6 * 3600,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        初始化统计器
+
+        Args:
+            window_seconds: 滑动窗口长度（秒），用于速率和百分位统计
+            price_per_second: 各分辨率每秒视频单价，默认使用DEFAULT_PRICE_PER_SECOND
+            stale_after: 提交多少秒后仍未观察到结束状态的任务视为过期，None表示不过期
+            clock: 时钟函数，回放时替换为虚拟时钟
+        """
+        self.window_seconds = window_seconds
+        self.price_per_second = dict(price_per_second or DEFAULT_PRICE_PER_SECOND)
+        self.stale_after = stale_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._expired = 0
+        # 上一次预测是否饱和，只在预测变化时记录日志
+        self._saturation_expected = False
+
+        # 进行中的任务: ARN -> 任务记录
+        self._in_flight: Dict[str, Dict[str, Any]] = {}
+
+        # 累计用量: (团队, 时长, 分辨率) -> 计数
+        self._totals: Dict[Tuple[str, str, str], Dict[str, float]] = defaultdict(
+            lambda: {"jobs": 0, "billable_seconds": 0, "cost": 0.0, "failed": 0}
+        )
+
+        # 滑动窗口
+        self._submissions = RollingWindow(window_seconds)
+        self._completions = RollingWindow(window_seconds)
+        # 服务端提交到结束的耗时（submitTime -> endTime）
+        self._service_times = RollingWindow(window_seconds)
+        # 提交到首次轮询看到InProgress的耗时，精度受轮询间隔限制
+        self._queue_estimates = RollingWindow(window_seconds)
+
+    def set_clock(self, clock: Callable[[], float]):
+        """
+        替换未显式传入时间戳时使用的时钟（例如回放时使用虚拟时钟）
+
+        Args:
+            clock: 时钟函数，返回epoch秒
+        """
+        with self._lock:
+            self._clock = clock
+
+    def estimate_cost(self, duration: str, resolution: str) -> float:
+        """
+        估算单个任务的费用
+
+        Args:
+            duration: 视频时长
+            resolution: 分辨率
+
+        Returns:
+            预估费用（美元）
+        """
+        return billable_seconds(duration) * self.price_per_second.get(resolution, 0.0)
+
+    def record_submission(
+        self,
+        invocation_arn: str,
+        model_input: Dict[str, Any],
+        team: Optional[str] = None,
+        now: Optional[float] = None
+    ):
+        """
+        记录一次任务提交
+
+        Args:
+            invocation_arn: 任务ARN
+            model_input: 提交的模型输入
+            team: 提交任务的团队（可选）
+            now: 提交时间戳，默认为当前时间
+        """
+        now = self._clock() if now is None else now
+        duration = model_input.get("duration", "5s")
+        resolution = model_input.get("resolution", "720p")
+        team = team or "default"
+
+        with self._lock:
+            self._in_flight[invocation_arn] = {
+                "team": team,
+                "duration": duration,
+                "resolution": resolution,
+                "submitted_at": now,
+                "started_at": None,
+            }
+            totals = self._totals[(team, duration, resolution)]
+            totals["jobs"] += 1
+            totals["billable_seconds"] += billable_seconds(duration)
+            totals["cost"] += self.estimate_cost(duration, resolution)
+            self._submissions.add(1, now)
+
+    def observe_status(
+        self,
+        invocation_arn: str,
+        status_info: Dict[str, Any],
+        now: Optional[float] = None
+    ):
+        """
+        根据get_async_invoke的返回结果（或list_async_invokes中的一项）更新任务记录
+
+        Bedrock不返回任务开始执行的时间，服务耗时按submitTime到endTime计算；
+        排队时间只能估计为提交到首次轮询看到InProgress的间隔，
+        首次被观察到时已结束的任务不计入排队时间估计。
+
+        Args:
+            invocation_arn: 任务ARN
+            status_info: 任务状态信息
+            now: 观察时间戳，默认为当前时间
+        """
+        now = self._clock() if now is None else now
+        status = status_info.get("status")
+
+        with self._lock:
+            job = self._in_flight.get(invocation_arn)
+            if job is None:
+                return
+
+            if status == "InProgress" and job["started_at"] is None:
+                job["started_at"] = now
+            elif status in TERMINAL_STATUSES:
+                del self._in_flight[invocation_arn]
+                service_submit = _to_epoch(status_info.get("submitTime"))
+                service_end = _to_epoch(status_info.get("endTime"))
+                if service_submit is not None and service_end is not None:
+                    self._service_times.add(max(0.0, service_end - service_submit), now)
+                else:
+                    self._service_times.add(max(0.0, now - job["submitted_at"]), now)
+
+                if job["started_at"] is not None:
+                    self._queue_estimates.add(max(0.0, job["started_at"] - job["submitted_at"]), now)
+                self._completions.add(1, now)
+
+                if status == "Failed":
+                    key = (job["team"], job["duration"], job["resolution"])
+                    self._totals[key]["failed"] += 1
+
+    def _expire_stale(self, now: float):
+        if self.stale_after is None:
+            return
+        cutoff = now - self.stale_after
+        stale = [arn for arn, job in self._in_flight.items() if job["submitted_at"] < cutoff]
+        for arn in stale:
+            del self._in_flight[arn]
+        if stale:
+            self._expired += len(stale)
+            logger.warning(f"⚠️  {len(stale)} 个任务超过 {self.stale_after} 秒未观察到结束状态，已移出进行中列表")
+
+    def reconcile(self, in_progress_arns: Iterable[str], as_of: Optional[float] = None) -> int:
+        """
+        按服务端的进行中任务列表校正进行中任务
+
+        as_of之前提交、但不在in_progress_arns中的任务已在服务端结束，
+        移出进行中列表并计入完成速率（结束时间未知，不计入耗时统计）。
+
+        Args:
+            in_progress_arns: 服务端状态为InProgress的任务ARN
+            as_of: 获取列表的时间戳，默认为当前时间
+
+        Returns:
+            移出的任务数
+        """
+        as_of = self._clock() if as_of is None else as_of
+        active = set(in_progress_arns)
+        with self._lock:
+            finished = [
+                arn for arn, job in self._in_flight.items()
+                if arn not in active and job["submitted_at"] < as_of
+            ]
+            for arn in finished:
+                del self._in_flight[arn]
+                self._completions.add(1, as_of)
+        if finished:
+            logger.info(f"🔄 校正进行中任务: {len(finished)} 个任务已在服务端结束")
+        return len(finished)
+
+    def in_flight(self, now: Optional[float] = None) -> int:
+        """当前进行中的任务数"""
+        with self._lock:
+            self._expire_stale(self._clock() if now is None else now)
+            return len(self._in_flight)
+
+    def usage_summary(self) -> Dict[str, Any]:
+        """
+        按团队汇总累计用量
+
+        Returns:
+            {团队: {"jobs", "billable_seconds", "cost", "failed", "breakdown"}}，
+            breakdown按"时长/分辨率"细分
+        """
+        summary: Dict[str, Any] = {}
+        with self._lock:
+            for (team, duration, resolution), totals in self._totals.items():
+                team_summary = summary.setdefault(team, {
+                    "jobs": 0, "billable_seconds": 0, "cost": 0.0, "failed": 0,
+                    "breakdown": {},
+                })
+                for field in ("jobs", "billable_seconds", "cost", "failed"):
+                    team_summary[field] += totals[field]
+                team_summary["breakdown"][f"{duration}/{resolution}"] = dict(totals)
+        return summary
+
+    def latency_stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        窗口内的耗时统计
+
+        Returns:
+            {"service_time": {...}, "queue_time_estimate": {...}, "expired": 过期任务数}。
+            service_time为服务端submitTime到endTime的耗时，包含mean/p50/p90/p99（秒）；
+            queue_time_estimate受轮询间隔限制，只给出样本数和均值，
+            应视为不超过一个轮询间隔误差的估计值
+        """
+        now = self._clock() if now is None else now
+
+        def stats(window: RollingWindow) -> Dict[str, Optional[float]]:
+            return {
+                "count": window.count(now),
+                "mean": window.mean(now),
+                "p50": window.percentile(50, now),
+                "p90": window.percentile(90, now),
+                "p99": window.percentile(99, now),
+            }
+
+        with self._lock:
+            return {
+                "service_time": stats(self._service_times),
+                "queue_time_estimate": {
+                    "count": self._queue_estimates.count(now),
+                    "mean": self._queue_estimates.mean(now),
+                },
+                "expired": self._expired,
+            }
+
+    def forecast_saturation(self, quota: int, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        预测进行中任务数何时达到并发配额
+
+        按窗口内的提交速率和完成速率线性外推（窗口未填满时按实际观察时长
+        计算速率）；同时用Little定律（稳态并发 = 提交速率 × 平均处理时长）
+        判断当前速率下是否终将饱和。预测结果变化时才记录日志，可以频繁调用。
+
+        Args:
+            quota: 并发任务配额
+            now: 当前时间戳，默认为当前时间
+
+        Returns:
+            预测结果，seconds_to_saturation为None表示按当前速率不会饱和
+        """
+        now = self._clock() if now is None else now
+
+        with self._lock:
+            self._expire_stale(now)
+            in_flight = len(self._in_flight)
+            # 提交和完成速率按同一观察时长计算：从窗口内最早的样本开始，
+            # 突发提交刚开始、窗口尚未填满时不会被整个窗口长度摊薄
+            starts = [
+                t for t in (self._submissions.oldest(now), self._completions.oldest(now))
+                if t is not None
+            ]
+            since = min(starts) if starts else now
+            arrival_rate = self._submissions.rate(now, since)
+            completion_rate = self._completions.rate(now, since)
+            mean_service = self._service_times.mean(now) or 0.0
+
+        steady_state = arrival_rate * mean_service
+        net_rate = arrival_rate - completion_rate
+
+        if in_flight >= quota:
+            seconds_to_saturation = 0.0
+        elif net_rate > 0:
+            seconds_to_saturation = (quota - in_flight) / net_rate
+        else:
+            seconds_to_saturation = None
+
+        forecast = {
+            "quota": quota,
+            "in_flight": in_flight,
+            "utilization": in_flight / quota if quota else None,
+            "arrival_rate": arrival_rate,
+            "completion_rate": completion_rate,
+            "steady_state_in_flight": steady_state,
+            "will_saturate": seconds_to_saturation is not None or steady_state >= quota,
+            "seconds_to_saturation": seconds_to_saturation,
+        }
+
+        with self._lock:
+            changed = forecast["will_saturate"] != self._saturation_expected
+            self._saturation_expected = forecast["will_saturate"]
+        if changed and forecast["will_saturate"]:
+            logger.warning(
+                f"⚠️  并发配额预计饱和: 进行中 {in_flight}/{quota}, "
+                f"稳态并发 {steady_state:.1f}, 剩余 {seconds_to_saturation} 秒"
+            )
+        elif changed:
+            logger.info(f"✅ 并发配额不再预计饱和: 进行中 {in_flight}/{quota}")
+        return forecast
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Luma Ray2 请求录制与回放
+在boto3客户端边界录制真实会话（含耗时），离线按实时或加速回放，用于可重复的性能回归测试
+"""
+
+import io
+import os
+import builtins
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+import botocore.exceptions
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+# 录制的操作
+RECORDED_OPERATIONS = {
+    "start_async_invoke",
+    "get_async_invoke",
+    "list_async_invokes",
+    "head_object",
+    "get_object",
+    "put_object",
+    "copy_object",
+    "upload_file",
+    "download_file",
+    "get_bucket_lifecycle_configuration",
+    "put_bucket_lifecycle_configuration",
+}
+
+# 按时间线回放的操作：返回录制时刻不晚于当前回放时刻的最新响应，
+# 因此不同的轮询间隔会看到与真实服务一致的状态变化
+_TIMELINE_OPERATIONS = {"get_async_invoke", "list_async_invokes"}
+
+# 超过此长度的字符串只保存哈希
+_MAX_INLINE_TEXT = 8192
+
+
+def _digest(data) -> Dict[str, Any]:
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return {"__sha256__": hashlib.sha256(data).hexdigest()[:32], "size": len(data)}
+
+
+def _redact(value: Any) -> Any:
+    """
+    转换为可写入磁带的JSON值：关键帧base64、二进制内容和超长文本替换为哈希
+    """
+    if isinstance(value, dict):
+        if value.get("type") == "base64" and "data" in value:
+            return {**value, "data": _digest(value["data"])}
+        return {str(k): _redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return _digest(value)
+    if isinstance(value, str):
+        return value if len(value) <= _MAX_INLINE_TEXT else _digest(value)
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return {"__type__": type(value).__name__}
+
+
+def _restore(value: Any) -> Any:
+    """还原磁带中的datetime"""
+    if isinstance(value, dict):
+        if "__datetime__" in value:
+            return datetime.fromisoformat(value["__datetime__"])
+        return {k: _restore(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_restore(v) for v in value]
+    return value
+
+
+def _replayed_error(error: Dict[str, Any]) -> Exception:
+    """按录制的类型重建非ClientError异常，未知类型还原为ConnectionError"""
+    name = error.get("type", "")
+    cls = getattr(botocore.exceptions, name, None) or getattr(builtins, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        return ConnectionError(error["message"])
+    if issubclass(cls, botocore.exceptions.BotoCoreError):
+        # botocore异常按fmt格式化关键字参数构造，磁带中只有最终消息
+        instance = cls.__new__(cls)
+        Exception.__init__(instance, error["message"])
+        instance.kwargs = {}
+        return instance
+    try:
+        return cls(error["message"])
+    except Exception:
+        return ConnectionError(error["message"])
+
+
+def _fingerprint(operation: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps([operation, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class _Body:
+    """get_object的Body替身，提供read()"""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._stream.read(amt)
+
+    def close(self):
+        self._stream.close()
+
+
+class CassetteRecorder:
+    """
+    录制会话
+
+    通过wrap()包装boto3客户端，被包装客户端的RECORDED_OPERATIONS调用会
+    连同参数、响应（或错误）、开始时刻和耗时写入gzip压缩的JSON Lines磁带。
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化录制会话
+
+        Args:
+            path: 磁带文件路径（.jsonl.gz）
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._write({
+            "version": CASSETTE_VERSION,
+            "recorded_at": datetime.now().isoformat(),
+            "started_at": self._start,
+        })
+        logger.info(f"🔴 开始录制: {path}")
+
+    def _write(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def wrap(self, boto3_client, service: str) -> "_RecordingClient":
+        """
+        包装boto3客户端
+
+        Args:
+            boto3_client: 要录制的boto3客户端
+            service: 服务名（"bedrock-runtime" 或 "s3"）
+        """
+        return _RecordingClient(self, boto3_client, service)
+
+    def record(
+        self,
+        service: str,
+        operation: str,
+        params: Dict[str, Any],
+        started: float,
+        elapsed: float,
+        response: Any = None,
+        error: Optional[Exception] = None
+    ):
+        """写入一次调用"""
+        params = _redact(params)
+        entry = {
+            "service": service,
+            "operation": operation,
+            "fingerprint": _fingerprint(operation, params),
+            "params": params,
+            "offset": round(started - self._start, 6),
+            "elapsed": round(elapsed, 6),
+        }
+        if error is not None:
+            entry["error"] = {
+                "type": type(error).__name__,
+                "message": str(error),
+                "response": _redact(getattr(error, "response", None)),
+            }
+        else:
+            entry["response"] = _redact(response)
+        self._write(entry)
+
+    def close(self):
+        """结束录制"""
+        with self._lock:
+            self._file.close()
+        logger.info(f"⏹️  录制结束: {self.path}")
+
+
+class _RecordingClient:
+    def __init__(self, recorder: CassetteRecorder, client, service: str):
+        self._recorder = recorder
+        self._client = client
+        self._service = service
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name not in RECORDED_OPERATIONS:
+            return attr
+
+        def recorded(*args, **kwargs):
+            params = dict(kwargs)
+            if args:
+                params["__args__"] = list(args)
+            started = time.time()
+            try:
+                response = attr(*args, **kwargs)
+            except Exception as e:
+                self._recorder.record(
+                    self._service, name, params, started, time.time() - started, error=e
+                )
+                raise
+
+            recorded_response = response
+            if name == "get_object":
+                # 读出Body以便记录大小，再以等价对象返回给调用方
+                data = response["Body"].read()
+                response = dict(response, Body=_Body(data))
+                recorded_response = dict(response, Body=data)
+            elif name == "download_file":
+                filename = kwargs.get("Filename", args[2] if len(args) > 2 else None)
+                recorded_response = {"size": os.path.getsize(filename)} if filename else None
+
+            self._recorder.record(
+                self._service, name, params, started, time.time() - started,
+                response=recorded_response
+            )
+            return response
+
+        return recorded
+
+
+class ReplaySession:
+    """
+    回放会话
+
+    speed为回放倍速：1.0为实时，10.0为十倍速；None表示即时回放，
+    不产生真实等待，虚拟时钟只由调用耗时和sleep()推进。即时回放时
+    每个工作线程有自己的虚拟时钟，从主线程的虚拟时刻开始，因此并发
+    调用的耗时相互重叠而不是累加；主线程读取时钟时追到所有线程中
+    最晚的虚拟时刻（相当于等待工作线程完成）。
+
+    now()返回与录制时一致的epoch时间戳，可直接作为客户端、熔断器
+    和用量统计器的时钟。
+    """
+
+    def __init__(self, path: str, speed: Optional[float] = 1.0):
+        """
+        加载磁带
+
+        Args:
+            path: 磁带文件路径
+            speed: 回放倍速，None为即时回放
+        """
+        self.path = path
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._start = time.time()
+        # 即时回放：工作线程各自的虚拟时刻、主线程的虚拟时刻、所有线程中最晚的虚拟时刻
+        self._local = threading.local()
+        self._main_offset = 0.0
+        self._latest = 0.0
+
+        self._by_fingerprint: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._by_operation: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursors: Dict[str, int] = defaultdict(int)
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"不支持的磁带版本: {header.get('version')}")
+            self._recorded_start = header.get("started_at")
+            if self._recorded_start is None:
+                self._recorded_start = datetime.fromisoformat(header["recorded_at"]).timestamp()
+            count = 0
+            for line in f:
+                entry = json.loads(line)
+                self._by_fingerprint[entry["fingerprint"]].append(entry)
+                self._by_operation[entry["operation"]].append(entry)
+                count += 1
+        # 并发调用按完成顺序写入，时间线回放需要按开始时刻排序
+        for entries in self._by_fingerprint.values():
+            entries.sort(key=lambda entry: entry["offset"])
+        logger.info(f"▶️  已加载磁带 {path}: {count} 次调用")
+
+    def _offset(self) -> float:
+        """当前线程的虚拟时刻（相对录制开始的秒数）"""
+        if self.speed:
+            return (time.time() - self._start) * self.speed
+        with self._lock:
+            if threading.current_thread() is threading.main_thread():
+                self._main_offset = max(self._main_offset, self._latest)
+                return self._main_offset
+            offset = getattr(self._local, "offset", None)
+            if offset is None:
+                offset = self._local.offset = self._main_offset
+            return offset
+
+    def now(self) -> float:
+        """当前虚拟时刻（epoch秒，与录制时的时间戳一致）"""
+        return self._recorded_start + self._offset()
+
+    def sleep(self, seconds: float):
+        """
+        按回放倍速等待
+
+        replay_client()会用它替换客户端轮询和熔断器排队中的sleep，
+        使等待也随回放加速。
+        """
+        if seconds <= 0:
+            return
+        if self.speed:
+            time.sleep(seconds / self.speed)
+            return
+        offset = self._offset() + seconds
+        with self._lock:
+            if threading.current_thread() is threading.main_thread():
+                self._main_offset = offset
+            else:
+                self._local.offset = offset
+            self._latest = max(self._latest, offset)
+
+    def client(self, service: str) -> "_ReplayClient":
+        """
+        获取回放客户端，用于替换对应的boto3客户端
+
+        Args:
+            service: 服务名（"bedrock-runtime" 或 "s3"）
+        """
+        return _ReplayClient(self, service)
+
+    def _next(self, key: str, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            index = self._cursors[key]
+            self._cursors[key] = index + 1
+        # 录制的调用用完后重复最后一次
+        return entries[min(index, len(entries) - 1)]
+
+    def _lookup(self, operation: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        fingerprint = _fingerprint(operation, params)
+        entries = self._by_fingerprint.get(fingerprint)
+
+        if entries and operation in _TIMELINE_OPERATIONS:
+            now = self._offset()
+            chosen = entries[0]
+            for entry in entries:
+                if entry["offset"] > now:
+                    break
+                chosen = entry
+            return chosen
+        if entries:
+            return self._next(fingerprint, entries)
+
+        # 参数不同（例如新的提示或随机键名）时按操作顺序回放
+        entries = self._by_operation.get(operation)
+        if not entries:
+            raise KeyError(f"磁带中没有 {operation} 的录制")
+        return self._next(operation, entries)
+
+    def play(self, operation: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        params = dict(kwargs)
+        if args:
+            params["__args__"] = list(args)
+        entry = self._lookup(operation, _redact(params))
+        self.sleep(entry["elapsed"])
+
+        if "error" in entry:
+            error = entry["error"]
+            if error["response"]:
+                raise ClientError(_restore(error["response"]), operation)
+            raise _replayed_error(error)
+
+        response = _restore(entry["response"])
+        if operation == "get_object":
+            response["Body"] = _Body(b"\0" * response["Body"]["size"])
+        elif operation == "download_file":
+            filename = kwargs.get("Filename", args[2] if len(args) > 2 else None)
+            with open(filename, 'wb') as f:
+                f.write(b"\0" * (response or {}).get("size", 0))
+            return None
+        return response
+
+
+class _ReplayClient:
+    def __init__(self, session: ReplaySession, service: str):
+        self._session = session
+        self._service = service
+
+    def __getattr__(self, name: str):
+        if name not in RECORDED_OPERATIONS:
+            raise AttributeError(f"回放客户端不支持 {self._service}.{name}")
+
+        def replayed(*args, **kwargs):
+            return self._session.play(name, args, kwargs)
+
+        return replayed
+
+
+def record_client(client, path: str) -> CassetteRecorder:
+    """
+    为LumaRay2Client开启录制
+
+    Args:
+        client: LumaRay2Client实例
+        path: 磁带文件路径
+
+    Returns:
+        录制会话，结束时调用close()
+    """
+    recorder = CassetteRecorder(path)
+    s3_client = client.s3_client
+    client.bedrock_runtime = recorder.wrap(client.bedrock_runtime, "bedrock-runtime")
+    client.s3_client = recorder.wrap(s3_client, "s3")
+    # 暂存器可能使用自己的S3客户端（其他区域或凭证），只包装而不替换
+    if client.stager.s3_client is s3_client:
+        client.stager.s3_client = client.s3_client
+    else:
+        client.stager.s3_client = recorder.wrap(client.stager.s3_client, "s3")
+    return recorder
+
+
+def replay_client(client, path: str, speed: Optional[float] = 1.0) -> ReplaySession:
+    """
+    让LumaRay2Client从磁带回放，不访问网络
+
+    客户端的轮询、熔断器、用量统计器和暂存器都改用回放会话的虚拟时钟。
+
+    Args:
+        client: LumaRay2Client实例
+        path: 磁带文件路径
+        speed: 回放倍速，None为即时回放
+
+    Returns:
+        回放会话
+    """
+    session = ReplaySession(path, speed)
+    client.bedrock_runtime = session.client("bedrock-runtime")
+    client.s3_client = session.client("s3")
+    client.stager.s3_client = client.s3_client
+    client.set_clock(session.now, session.sleep)
+    return session
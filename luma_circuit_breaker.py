@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Luma Ray2 依赖熔断器
+按端点（提交、状态查询、S3读写）统计错误率和延迟百分位，依赖异常时快速失败或限量排队
+"""
+
+import time
+import logging
+import threading
+from typing import Optional, Dict, Any, Callable
+
+from botocore.exceptions import ClientError, BotoCoreError
+
+from luma_accounting import RollingWindow
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 客户端使用的端点
+SUBMIT = "submit"
+STATUS = "status"
+S3_GET = "s3_get"
+S3_PUT = "s3_put"
+
+# 视为依赖不健康的错误码（其余4xx属于请求本身的问题，不计入错误率）
+_UNHEALTHY_ERROR_CODES = {
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ServiceUnavailable",
+    "InternalServerException",
+    "InternalError",
+    "SlowDown",
+    "RequestTimeout",
+    "ModelNotReadyException",
+}
+
+# 各端点的默认参数：提交熔断时有界排队，等待依赖恢复而不是直接丢弃请求
+DEFAULT_ENDPOINT_PARAMS: Dict[str, Dict[str, Any]] = {
+    SUBMIT: {"max_queue": 16, "queue_timeout": 30},
+}
+
+
+def is_dependency_failure(error: Exception) -> bool:
+    """
+    判断异常是否说明依赖不健康
+
+    Args:
+        error: 调用抛出的异常
+
+    Returns:
+        True表示计入错误率；参数错误、对象不存在等客户端错误返回False
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return code in _UNHEALTHY_ERROR_CODES or status >= 500
+    # botocore的连接失败、超时等；文件不存在等本地OSError不计入
+    return isinstance(error, (BotoCoreError, ConnectionError))
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时拒绝调用"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"依赖 {name} 熔断中，{retry_after:.1f}秒后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    单个端点的熔断器
+
+    关闭状态下统计滑动窗口内的错误率和延迟百分位，超过阈值即打开；
+    打开一段时间后进入半开状态，只放行少量探测请求，探测成功则关闭，
+    失败则重新打开。打开期间的调用默认立即失败（shed），也可以配置
+    有界排队，等待依赖恢复。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60,
+        min_calls: int = 10,
+        error_rate_threshold: float = 0.5,
+        latency_threshold: Optional[float] = None,
+        latency_percentile: float = 95,
+        open_seconds: float = 30,
+        half_open_max_calls: int = 1,
+        max_queue: int = 0,
+        queue_timeout: float = 0,
+        is_failure: Callable[[Exception], bool] = is_dependency_failure,
+        clock: Callable[[], float] = time.time,
+        sleep: Optional[Callable[[float], None]] = None
+    ):
+        """
+        初始化熔断器
+
+        Args:
+            name: 端点名称
+            window_seconds: 统计窗口长度（秒）
+            min_calls: 窗口内至少有多少次调用才判断是否熔断
+            error_rate_threshold: 错误率阈值 (0-1)
+            latency_threshold: 延迟阈值（秒），None表示不按延迟熔断
+            latency_percentile: 与latency_threshold比较的延迟百分位
+            open_seconds: 打开状态持续时间（秒），之后进入半开探测
+            half_open_max_calls: 半开状态下同时放行的探测请求数
+            max_queue: 熔断期间最多排队等待的调用数，0表示直接拒绝
+            queue_timeout: 排队最长等待时间（秒）
+            is_failure: 判断异常是否计入错误率
+            clock: 时钟函数，回放时替换为虚拟时钟
+            sleep: 排队等待使用的sleep（可选），默认在条件变量上等待；
+                使用虚拟时钟时应同时提供，否则排队会按真实时间等待
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.latency_percentile = latency_percentile
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.is_failure = is_failure
+        self._clock = clock
+        self._sleep = sleep
+
+        self._condition = threading.Condition()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._waiters = 0
+        self._reset_windows()
+
+    def set_clock(self, clock: Callable[[], float], sleep: Optional[Callable[[float], None]] = None):
+        """
+        替换时钟（例如回放时使用虚拟时钟）
+
+        Args:
+            clock: 时钟函数
+            sleep: 排队等待使用的sleep，使用虚拟时钟时应同时提供
+        """
+        with self._condition:
+            self._clock = clock
+            self._sleep = sleep
+
+    def _reset_windows(self):
+        # 错误窗口中1表示失败、0表示成功，均值即错误率
+        self._errors = RollingWindow(self.window_seconds)
+        self._latencies = RollingWindow(self.window_seconds)
+
+    @property
+    def state(self) -> str:
+        """当前状态（打开超时后视为半开）"""
+        with self._condition:
+            self._refresh(self._clock())
+            return self._state
+
+    def retry_after(self) -> float:
+        """距离下一次允许探测还有多少秒"""
+        with self._condition:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self) -> float:
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - self._clock())
+
+    def _refresh(self, now: float):
+        if self._state == OPEN and now >= self._opened_at + self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"🔄 依赖 {self.name} 熔断器进入半开状态，开始探测")
+
+    def _trip(self, now: float, reason: str):
+        self._state = OPEN
+        self._opened_at = now
+        self._probes = 0
+        logger.warning(f"⛔ 依赖 {self.name} 熔断器打开: {reason}，{self.open_seconds}秒后探测")
+        self._condition.notify_all()
+
+    def _close(self):
+        self._state = CLOSED
+        self._probes = 0
+        self._reset_windows()
+        logger.info(f"✅ 依赖 {self.name} 已恢复，熔断器关闭")
+        self._condition.notify_all()
+
+    def _try_acquire(self, now: float) -> bool:
+        self._refresh(now)
+        if self._state == CLOSED:
+            return True
+        if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        return False
+
+    def _acquire(self) -> bool:
+        """
+        获取调用许可
+
+        Returns:
+            是否为半开探测调用
+        """
+        with self._condition:
+            now = self._clock()
+            if self._try_acquire(now):
+                return self._state == HALF_OPEN
+
+            if self._waiters >= self.max_queue:
+                raise CircuitOpenError(self.name, self._retry_after_locked())
+
+            # 有界排队，等待探测成功或超时
+            deadline = now + self.queue_timeout
+            self._waiters += 1
+            try:
+                while True:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        raise CircuitOpenError(self.name, self._retry_after_locked())
+                    wake_at = self._opened_at + self.open_seconds - self._clock()
+                    self._wait(min(remaining, max(wake_at, 0.05)))
+                    if self._try_acquire(self._clock()):
+                        return self._state == HALF_OPEN
+            finally:
+                self._waiters -= 1
+
+    def _wait(self, seconds: float):
+        # 调用方持有条件变量的锁
+        if self._sleep is None:
+            self._condition.wait(seconds)
+            return
+        self._condition.release()
+        try:
+            self._sleep(seconds)
+        finally:
+            self._condition.acquire()
+
+    def _record(self, failed: bool, latency: float, probe: bool):
+        with self._condition:
+            now = self._clock()
+            if probe:
+                self._probes = max(0, self._probes - 1)
+                if self._state != HALF_OPEN:
+                    return
+                too_slow = self.latency_threshold is not None and latency > self.latency_threshold
+                if failed or too_slow:
+                    self._trip(now, "半开探测失败")
+                else:
+                    self._close()
+                return
+
+            self._errors.add(1 if failed else 0, now)
+            self._latencies.add(latency, now)
+            if self._state != CLOSED or self._errors.count(now) < self.min_calls:
+                return
+
+            error_rate = self._errors.mean(now)
+            if error_rate >= self.error_rate_threshold:
+                self._trip(now, f"错误率 {error_rate:.0%}")
+                return
+
+            if self.latency_threshold is not None:
+                latency_p = self._latencies.percentile(self.latency_percentile, now)
+                if latency_p > self.latency_threshold:
+                    self._trip(now, f"p{self.latency_percentile:g}延迟 {latency_p:.1f}秒")
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        通过熔断器调用函数
+
+        Raises:
+            CircuitOpenError: 熔断器打开且无法排队时
+        """
+        probe = self._acquire()
+        start = self._clock()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record(self.is_failure(e), self._clock() - start, probe)
+            raise
+        self._record(False, self._clock() - start, probe)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """当前状态与窗口统计"""
+        with self._condition:
+            now = self._clock()
+            self._refresh(now)
+            return {
+                "state": self._state,
+                "calls": self._errors.count(now),
+                "error_rate": self._errors.mean(now),
+                "latency_p50": self._latencies.percentile(50, now),
+                "latency_p95": self._latencies.percentile(95, now),
+                "retry_after": self._retry_after_locked(),
+                "queued": self._waiters,
+            }
+
+
+class DependencyBreakers:
+    """
+    客户端各依赖端点的熔断器集合
+
+    默认覆盖submit、status、s3_get、s3_put四个端点，
+    可通过overrides按端点调整熔断参数。参数优先级：overrides >
+    defaults > DEFAULT_ENDPOINT_PARAMS（submit默认有界排队）。
+    """
+
+    def __init__(self, overrides: Optional[Dict[str, Dict[str, Any]]] = None, **defaults):
+        """
+        初始化熔断器集合
+
+        Args:
+            overrides: 端点名 -> CircuitBreaker参数
+            **defaults: 所有端点共用的CircuitBreaker参数
+        """
+        overrides = overrides or {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        for name in set((SUBMIT, STATUS, S3_GET, S3_PUT)) | set(overrides):
+            params = dict(DEFAULT_ENDPOINT_PARAMS.get(name, {}))
+            params.update(defaults)
+            params.update(overrides.get(name, {}))
+            self._breakers[name] = CircuitBreaker(name, **params)
+
+    def __getitem__(self, name: str) -> CircuitBreaker:
+        return self._breakers[name]
+
+    def set_clock(self, clock: Callable[[], float], sleep: Optional[Callable[[float], None]] = None):
+        """
+        替换所有端点熔断器的时钟（例如回放时使用虚拟时钟）
+
+        Args:
+            clock: 时钟函数
+            sleep: 排队等待使用的sleep
+        """
+        for breaker in self._breakers.values():
+            breaker.set_clock(clock, sleep)
+
+    def call(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """通过指定端点的熔断器调用函数"""
+        return self._breakers[name].call(func, *args, **kwargs)
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """所有端点的状态与统计"""
+        return {name: breaker.stats() for name, breaker in self._breakers.items()}
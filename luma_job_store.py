@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Luma Ray2 紧凑任务状态存储
+以列式数组保存大量任务的状态，支持按状态快速查询，完整响应仅在需要时重建
+"""
+
+import math
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from enum import IntEnum
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 输出路径模板中代替任务ID的占位符
+_ID_PLACEHOLDER = "\0"
+
+
+class JobStatus(IntEnum):
+    """任务状态"""
+    UNKNOWN = 0
+    SUBMITTED = 1
+    IN_PROGRESS = 2
+    COMPLETED = 3
+    FAILED = 4
+
+
+_STATUS_BY_NAME = {
+    "Submitted": JobStatus.SUBMITTED,
+    "InProgress": JobStatus.IN_PROGRESS,
+    "Completed": JobStatus.COMPLETED,
+    "Failed": JobStatus.FAILED,
+}
+_NAME_BY_STATUS = {status: name for name, status in _STATUS_BY_NAME.items()}
+
+# 按数值排列，避免查询时构造枚举
+_STATUSES = tuple(JobStatus)
+
+_ACTIVE_STATUSES = (JobStatus.SUBMITTED, JobStatus.IN_PROGRESS)
+_TERMINAL_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED)
+
+
+def _epoch(value: Any) -> float:
+    if value is None:
+        return math.nan
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def _datetime(value: float) -> Optional[datetime]:
+    return None if math.isnan(value) else datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+class JobRecord:
+    """单个任务的轻量视图"""
+
+    __slots__ = (
+        "invocation_arn", "status", "submit_time", "end_time",
+        "output_uri", "failure_message",
+    )
+
+    def __init__(
+        self,
+        invocation_arn: str,
+        status: JobStatus,
+        submit_time: Optional[datetime],
+        end_time: Optional[datetime],
+        output_uri: Optional[str],
+        failure_message: Optional[str]
+    ):
+        self.invocation_arn = invocation_arn
+        self.status = status
+        self.submit_time = submit_time
+        self.end_time = end_time
+        self.output_uri = output_uri
+        self.failure_message = failure_message
+
+    def __repr__(self) -> str:
+        return f"JobRecord({self.invocation_arn!r}, {self.status.name})"
+
+
+class _Interned:
+    """字符串驻留表：重复出现的字符串只保存一份，列中只存下标"""
+
+    def __init__(self):
+        self._values: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        index = self._index.get(value)
+        if index is None:
+            index = len(self._values)
+            self._values.append(value)
+            self._index[value] = index
+        return index
+
+    def get(self, index: int) -> Optional[str]:
+        return None if index < 0 else self._values[index]
+
+    def find(self, value: str) -> Optional[int]:
+        """已驻留字符串的下标，不存在时返回None（不新增）"""
+        return self._index.get(value)
+
+
+class JobStore:
+    """
+    列式任务状态存储
+
+    每个任务只占用若干数组元素：ARN拆为驻留的前缀和任务ID，
+    状态为一个字节，提交/结束时间为双精度浮点，输出路径和失败信息
+    为驻留表下标。进行中的任务和已结束任务（按结束时间排序）另有索引，
+    查询时不需要扫描全部任务。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+        self._rows: Dict[str, int] = {}  # 任务ID -> 行号
+        # 任务ID相同但ARN前缀（账号/区域）不同的任务: (前缀下标, 任务ID) -> 行号
+        self._colliding_rows: Dict[Tuple[int, str], int] = {}
+        self._ids: List[str] = []
+        self._arn_prefixes = _Interned()
+        self._outputs = _Interned()
+        self._failures = _Interned()
+
+        self._prefix = array('l')
+        self._status = array('b')
+        self._submit = array('d')
+        self._end = array('d')
+        self._output = array('l')
+        self._failure = array('l')
+
+        # 进行中任务的行号
+        self._active = set()
+        # 已结束任务: 状态 -> (按结束时间排序的时间, 对应行号)
+        self._terminal: Dict[JobStatus, Tuple[array, array]] = {
+            status: (array('d'), array('l')) for status in _TERMINAL_STATUSES
+        }
+
+    @staticmethod
+    def _split_arn(invocation_arn: str) -> Tuple[str, str]:
+        prefix, _, job_id = invocation_arn.rpartition('/')
+        return prefix, job_id
+
+    def _lookup(self, invocation_arn: str) -> Optional[int]:
+        """已跟踪任务的行号，调用方持有锁"""
+        prefix, job_id = self._split_arn(invocation_arn)
+        row = self._rows.get(job_id)
+        if row is None:
+            return None
+        prefix_index = self._arn_prefixes.find(prefix)
+        if self._prefix[row] == prefix_index:
+            return row
+        return self._colliding_rows.get((prefix_index, job_id))
+
+    def _row(self, invocation_arn: str) -> int:
+        row = self._lookup(invocation_arn)
+        if row is not None:
+            return row
+
+        prefix, job_id = self._split_arn(invocation_arn)
+        prefix_index = self._arn_prefixes.add(prefix)
+        row = len(self._ids)
+        # 先追加所有列，最后登记行号
+        self._ids.append(job_id)
+        self._prefix.append(prefix_index)
+        self._status.append(JobStatus.UNKNOWN)
+        self._submit.append(math.nan)
+        self._end.append(math.nan)
+        self._output.append(-1)
+        self._failure.append(-1)
+        if job_id in self._rows:
+            self._colliding_rows[(prefix_index, job_id)] = row
+        else:
+            self._rows[job_id] = row
+        return row
+
+    def _set_status(self, row: int, status: JobStatus, end_time: float):
+        if status == JobStatus.UNKNOWN:
+            # 无法识别的状态不改变已知状态和索引
+            return
+        previous = _STATUSES[self._status[row]]
+        if previous in _TERMINAL_STATUSES:
+            # 已结束的任务不会再变化
+            return
+        self._status[row] = status
+
+        if status in _ACTIVE_STATUSES:
+            self._active.add(row)
+            return
+        self._active.discard(row)
+
+        if status in _TERMINAL_STATUSES:
+            if math.isnan(end_time):
+                end_time = self._submit[row] if not math.isnan(self._submit[row]) else 0.0
+            self._end[row] = end_time
+            times, rows = self._terminal[status]
+            position = bisect_left(times, end_time)
+            # 大多数任务按结束顺序到达，插入位置在末尾
+            times.insert(position, end_time)
+            rows.insert(position, row)
+
+    def add_submission(self, invocation_arn: str, submit_time: Any = None):
+        """
+        记录新提交的任务
+
+        Args:
+            invocation_arn: 任务ARN
+            submit_time: 提交时间（datetime或epoch秒），默认为空
+        """
+        with self._lock:
+            row = self._row(invocation_arn)
+            if not math.isnan(_epoch(submit_time)):
+                self._submit[row] = _epoch(submit_time)
+            if self._status[row] == JobStatus.UNKNOWN:
+                self._set_status(row, JobStatus.SUBMITTED, math.nan)
+
+    def observe(self, status_info: Dict[str, Any]):
+        """
+        用get_async_invoke的返回结果（或list_async_invokes中的一项）更新任务
+
+        只保留状态、时间、输出路径和失败信息，不持有传入的字典。
+
+        Args:
+            status_info: 任务状态信息
+        """
+        invocation_arn = status_info["invocationArn"]
+        _, job_id = self._split_arn(invocation_arn)
+        output_uri = (
+            status_info.get("outputDataConfig", {})
+            .get("s3OutputDataConfig", {})
+            .get("s3Uri")
+        )
+        if output_uri and job_id:
+            output_uri = output_uri.replace(job_id, _ID_PLACEHOLDER)
+
+        with self._lock:
+            row = self._row(invocation_arn)
+            submit_time = _epoch(status_info.get("submitTime"))
+            if not math.isnan(submit_time):
+                self._submit[row] = submit_time
+            if output_uri:
+                self._output[row] = self._outputs.add(output_uri)
+            failure_message = status_info.get("failureMessage")
+            if failure_message:
+                self._failure[row] = self._failures.add(failure_message)
+
+            status = _STATUS_BY_NAME.get(status_info.get("status"), JobStatus.UNKNOWN)
+            self._set_status(row, status, _epoch(status_info.get("endTime")))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, invocation_arn: str) -> bool:
+        with self._lock:
+            return self._lookup(invocation_arn) is not None
+
+    def _arn(self, row: int) -> str:
+        return f"{self._arn_prefixes.get(self._prefix[row])}/{self._ids[row]}"
+
+    def status(self, invocation_arn: str) -> JobStatus:
+        """
+        查询任务状态
+
+        Returns:
+            任务状态，未跟踪的任务返回JobStatus.UNKNOWN
+        """
+        with self._lock:
+            row = self._lookup(invocation_arn)
+            return JobStatus.UNKNOWN if row is None else _STATUSES[self._status[row]]
+
+    def get(self, invocation_arn: str) -> Optional[JobRecord]:
+        """
+        获取任务的轻量视图
+
+        Returns:
+            JobRecord，未跟踪的任务返回None
+        """
+        with self._lock:
+            row = self._lookup(invocation_arn)
+            if row is None:
+                return None
+            output = self._outputs.get(self._output[row])
+            return JobRecord(
+                invocation_arn=self._arn(row),
+                status=_STATUSES[self._status[row]],
+                submit_time=_datetime(self._submit[row]),
+                end_time=_datetime(self._end[row]),
+                output_uri=output.replace(_ID_PLACEHOLDER, self._ids[row]) if output else None,
+                failure_message=self._failures.get(self._failure[row]),
+            )
+
+    def in_progress(self) -> List[str]:
+        """所有未结束（已提交或进行中）任务的ARN"""
+        with self._lock:
+            return [self._arn(row) for row in self._active]
+
+    def finished_since(self, status: JobStatus, since: Any) -> Iterator[str]:
+        """
+        按结束时间查询已结束的任务
+
+        Args:
+            status: JobStatus.COMPLETED 或 JobStatus.FAILED
+            since: 起始时间（datetime或epoch秒）
+
+        Yields:
+            结束时间不早于since的任务ARN，按结束时间排序
+
+        Raises:
+            ValueError: status不是已结束状态时
+        """
+        if status not in _TERMINAL_STATUSES:
+            raise ValueError(f"只能按已结束状态查询: {status!r}，可选值: {list(_TERMINAL_STATUSES)}")
+        with self._lock:
+            times, rows = self._terminal[status]
+            start = bisect_left(times, _epoch(since))
+            matched = rows[start:]
+        return (self._arn(row) for row in matched)
+
+    def failed_since(self, since: Any) -> Iterator[str]:
+        """结束时间不早于since的失败任务ARN"""
+        return self.finished_since(JobStatus.FAILED, since)
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "completed": len(self._terminal[JobStatus.COMPLETED][1]),
+                "failed": len(self._terminal[JobStatus.FAILED][1]),
+                "total": len(self._ids),
+            }
+
+    def materialize(self, invocation_arn: str, client=None) -> Optional[Dict[str, Any]]:
+        """
+        按需生成完整的状态字典
+
+        Args:
+            invocation_arn: 任务ARN
+            client: LumaRay2Client（可选），提供时从服务获取完整响应并刷新存储
+
+        Returns:
+            与get_async_invoke返回结构一致的字典，未跟踪的任务返回None
+        """
+        if client is not None:
+            response = client.get_job_status(invocation_arn)
+            self.observe(response)
+            return response
+
+        record = self.get(invocation_arn)
+        if record is None:
+            return None
+
+        response: Dict[str, Any] = {
+            "invocationArn": record.invocation_arn,
+            "status": _NAME_BY_STATUS.get(record.status, "Unknown"),
+        }
+        if record.submit_time:
+            response["submitTime"] = record.submit_time
+        if record.end_time:
+            response["endTime"] = record.end_time
+        if record.output_uri:
+            response["outputDataConfig"] = {"s3OutputDataConfig": {"s3Uri": record.output_uri}}
+        if record.failure_message:
+            response["failureMessage"] = record.failure_message
+        return response
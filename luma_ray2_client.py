@@ -10,9 +10,14 @@ import time
 import base64
 import logging
 # import requests  # HTTP方法需要的依赖，已注释
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
 from pathlib import Path
 from urllib.parse import urlparse
+from botocore.config import Config
+from luma_accounting import UsageAccountant
+from luma_s3_staging import KeyframeStager
+from luma_circuit_breaker import DependencyBreakers, CircuitOpenError, SUBMIT, STATUS
+from luma_job_store import JobStore
 # from botocore.auth import SigV4Auth  # HTTP方法需要的依赖，已注释
 # from botocore.awsrequest import AWSRequest  # HTTP方法需要的依赖，已注释
 
@@ -20,45 +25,107 @@ from urllib.parse import urlparse
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 有界的连接/读取超时和重试次数，依赖异常时单次调用不会长时间占用工作线程
+BOTO_CONFIG = Config(
+    connect_timeout=5,
+    read_timeout=30,
+    retries={'max_attempts': 3, 'mode': 'standard'}
+)
+
 class LumaRay2Client:
     """Luma Ray2 模型客户端"""
     
-    def __init__(self, region_name: str = 'us-west-2'):
+    def __init__(
+        self,
+        region_name: str = 'us-west-2',
+        accountant: Optional[UsageAccountant] = None,
+        stager: Optional[KeyframeStager] = None,
+        breakers: Optional[DependencyBreakers] = None,
+        job_store: Optional[JobStore] = None
+    ):
         """
         初始化客户端
         
         Args:
             region_name: AWS区域名称
+            accountant: 用量统计器（可选），用于记录计费单位和配额占用
+            stager: 关键帧暂存器（可选），默认暂存到s3-demo-zy/temp_images/
+            breakers: 依赖熔断器（可选），默认为各端点使用默认参数的熔断器
+            job_store: 任务状态存储（可选），跟踪大量任务时代替保存完整响应
         """
         self.region_name = region_name
+        self.accountant = accountant
+        self.breakers = breakers or DependencyBreakers()
+        self.job_store = job_store
         self.bedrock_runtime = boto3.client(
             'bedrock-runtime',
-            region_name=region_name
+            region_name=region_name,
+            config=BOTO_CONFIG
         )
         self.s3_client = boto3.client(
             's3',
-            region_name=region_name
+            region_name=region_name,
+            config=BOTO_CONFIG
         )
+        self.stager = stager or KeyframeStager(self.s3_client, breakers=self.breakers)
         self.model_id = "luma.ray-v2:0"
+        # 轮询等待使用的时钟和sleep，回放时替换为虚拟时钟
+        self._clock = time.time
+        self._sleep = time.sleep
         
         # HTTP方法需要的凭证获取，已注释
         # session = boto3.Session()
         # self.credentials = session.get_credentials()
     
-    def _make_boto3_request(self, model_input: Dict, output_config: Dict) -> str:
+    def set_clock(self, clock: Callable[[], float], sleep: Callable[[float], None]):
+        """
+        替换客户端及其熔断器、暂存器、用量统计器使用的时钟（例如回放时使用虚拟时钟）
+        
+        Args:
+            clock: 时钟函数，返回epoch秒
+            sleep: 等待函数
+        """
+        self._clock = clock
+        self._sleep = sleep
+        self.breakers.set_clock(clock, sleep)
+        self.stager.set_clock(clock)
+        if self.accountant:
+            self.accountant.set_clock(clock)
+    
+    def now(self) -> float:
+        """客户端时钟的当前时刻"""
+        return self._clock()
+    
+    def sleep(self, seconds: float):
+        """按客户端时钟等待"""
+        self._sleep(seconds)
+    
+    def _make_boto3_request(
+        self,
+        model_input: Dict,
+        output_config: Dict,
+        team: Optional[str] = None
+    ) -> str:
         """使用boto3标准方法调用API"""
         try:
             logger.info("🔧 使用boto3标准方法调用...")
             
             # 根据官方API文档，modelInput应该是JSON value，不是字符串
-            response = self.bedrock_runtime.start_async_invoke(
+            response = self.breakers.call(
+                SUBMIT,
+                self.bedrock_runtime.start_async_invoke,
                 modelId=self.model_id,
                 modelInput=model_input,  # 直接传递字典，不转换为字符串
                 outputDataConfig=output_config
             )
             
             logger.info("✅ boto3方法调用成功!")
-            return response['invocationArn']
+            invocation_arn = response['invocationArn']
+            if self.accountant:
+                self.accountant.record_submission(invocation_arn, model_input, team)
+            if self.job_store is not None:
+                self.job_store.add_submission(invocation_arn, self._clock())
+            return invocation_arn
             
         except Exception as e:
             logger.error(f"❌ boto3方法失败: {str(e)}")
@@ -120,23 +187,8 @@ class LumaRay2Client:
         Returns:
             S3 URI
         """
-        try:
-            # 生成唯一的S3键名
-            import uuid
-            file_extension = Path(image_path).suffix
-            s3_key = f"temp_images/{uuid.uuid4()}{file_extension}"
-            bucket_name = "s3-demo-zy"
-            
-            # 上传文件
-            self.s3_client.upload_file(image_path, bucket_name, s3_key)
-            s3_uri = f"s3://{bucket_name}/{s3_key}"
-            
-            logger.info(f"📤 图片已上传到S3: {s3_uri}")
-            return s3_uri
-            
-        except Exception as e:
-            logger.error(f"❌ 图片上传失败: {str(e)}")
-            raise
+        # 按内容哈希命名，相同图片不会重复上传
+        return self.stager.stage(image_path)
     
     def text_to_video(
         self,
@@ -145,7 +197,8 @@ class LumaRay2Client:
         aspect_ratio: str = "16:9",
         duration: str = "5s",
         resolution: str = "720p",
-        loop: bool = False
+        loop: bool = False,
+        team: Optional[str] = None
     ) -> str:
         """
         文本到视频生成
@@ -157,6 +210,7 @@ class LumaRay2Client:
             duration: 视频时长 ("5s", "9s")
             resolution: 分辨率 ("540p", "720p")
             loop: 是否循环播放
+            team: 提交任务的团队（可选，用于用量统计）
             
         Returns:
             任务ARN
@@ -191,7 +245,7 @@ class LumaRay2Client:
         }
         
         # 使用boto3标准方法
-        invocation_arn = self._make_boto3_request(model_input, output_config)
+        invocation_arn = self._make_boto3_request(model_input, output_config, team)
         logger.info(f"✅ 文本到视频任务已启动: {invocation_arn}")
         return invocation_arn
         
@@ -217,7 +271,8 @@ class LumaRay2Client:
         aspect_ratio: str = "16:9",
         duration: str = "5s",
         resolution: str = "720p",
-        loop: bool = False
+        loop: bool = False,
+        team: Optional[str] = None
     ) -> str:
         """
         图片到视频生成
@@ -231,6 +286,7 @@ class LumaRay2Client:
             duration: 视频时长
             resolution: 分辨率
             loop: 是否循环播放
+            team: 提交任务的团队（可选，用于用量统计）
             
         Returns:
             任务ARN
@@ -252,43 +308,8 @@ class LumaRay2Client:
         logger.info(f"  - 循环播放: {loop}")
         logger.info(f"  - 输出路径: {s3_output_uri}")
         
-        # 读取并编码图片为base64
-        def encode_image_to_base64(image_path_or_uri):
-            if image_path_or_uri.startswith('s3://'):
-                # 如果是S3路径，先下载到本地
-                import tempfile
-                import os
-                from urllib.parse import urlparse
-                
-                parsed = urlparse(image_path_or_uri)
-                bucket = parsed.netloc
-                key = parsed.path.lstrip('/')
-                
-                with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                    self.s3_client.download_file(bucket, key, tmp_file.name)
-                    with open(tmp_file.name, 'rb') as f:
-                        image_data = f.read()
-                    os.unlink(tmp_file.name)
-            else:
-                # 本地文件
-                with open(image_path_or_uri, 'rb') as f:
-                    image_data = f.read()
-            
-            import base64
-            return base64.b64encode(image_data).decode('utf-8')
-        
-        def get_media_type(image_path):
-            ext = Path(image_path).suffix.lower()
-            if ext in ['.jpg', '.jpeg']:
-                return 'image/jpeg'
-            elif ext == '.png':
-                return 'image/png'
-            else:
-                return 'image/jpeg'  # 默认
-        
-        # 编码起始图片
-        start_image_b64 = encode_image_to_base64(start_image_path)
-        start_media_type = get_media_type(start_image_path)
+        # 读取并编码图片为base64（本地文件或S3路径，重复使用的图片只编码一次）
+        start_source = self.stager.keyframe_source(start_image_path)
         
         # 构建模型输入
         model_input = {
@@ -300,26 +321,16 @@ class LumaRay2Client:
             "keyframes": {
                 "frame0": {
                     "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": start_media_type,
-                        "data": start_image_b64
-                    }
+                    "source": start_source
                 }
             }
         }
         
         # 如果有结束图片，添加到关键帧
         if end_image_path:
-            end_image_b64 = encode_image_to_base64(end_image_path)
-            end_media_type = get_media_type(end_image_path)
             model_input["keyframes"]["frame1"] = {
                 "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": end_media_type,
-                    "data": end_image_b64
-                }
+                "source": self.stager.keyframe_source(end_image_path)
             }
         
         output_config = {
@@ -329,7 +340,7 @@ class LumaRay2Client:
         }
         
         # 使用boto3标准方法
-        invocation_arn = self._make_boto3_request(model_input, output_config)
+        invocation_arn = self._make_boto3_request(model_input, output_config, team)
         logger.info(f"✅ 图片到视频任务已启动: {invocation_arn}")
         return invocation_arn
         
@@ -357,9 +368,15 @@ class LumaRay2Client:
             任务状态信息
         """
         try:
-            response = self.bedrock_runtime.get_async_invoke(
+            response = self.breakers.call(
+                STATUS,
+                self.bedrock_runtime.get_async_invoke,
                 invocationArn=invocation_arn
             )
+            if self.accountant:
+                self.accountant.observe_status(invocation_arn, response)
+            if self.job_store is not None:
+                self.job_store.observe(response)
             return response
         except Exception as e:
             logger.error(f"❌ 获取任务状态失败: {str(e)}")
@@ -382,9 +399,14 @@ class LumaRay2Client:
         Returns:
             任务完成后的状态信息，超时返回None
         """
-        start_time = time.time()
+        start_time = self._clock()
+        
+        def sleep_within_budget(seconds):
+            # 不超过剩余等待时间
+            remaining = max_wait_time - (self._clock() - start_time)
+            self._sleep(max(0, min(seconds, remaining)))
         
-        while time.time() - start_time < max_wait_time:
+        while self._clock() - start_time < max_wait_time:
             try:
                 status_info = self.get_job_status(invocation_arn)
                 status = status_info.get('status', 'Unknown')
@@ -405,14 +427,22 @@ class LumaRay2Client:
                     return status_info
                 elif status in ['InProgress', 'Submitted']:
                     logger.info(f"任务进行中，{check_interval}秒后再次检查...")
-                    time.sleep(check_interval)
+                    sleep_within_budget(check_interval)
                 else:
                     logger.warning(f"未知状态: {status}")
-                    time.sleep(check_interval)
+                    sleep_within_budget(check_interval)
                     
+            except CircuitOpenError as e:
+                # 依赖熔断中：恢复探测前不再轮询，超出剩余等待时间则直接返回
+                remaining = max_wait_time - (self._clock() - start_time)
+                if e.retry_after >= remaining:
+                    logger.warning(f"{str(e)}，超出剩余等待时间，停止等待")
+                    return None
+                logger.warning(str(e))
+                sleep_within_budget(max(check_interval, e.retry_after))
             except Exception as e:
                 logger.error(f"检查任务状态时出错: {str(e)}")
-                time.sleep(check_interval)
+                sleep_within_budget(check_interval)
         
         logger.warning(f"等待超时（{max_wait_time}秒）")
         return None
@@ -428,13 +458,53 @@ class LumaRay2Client:
             任务列表
         """
         try:
-            response = self.bedrock_runtime.list_async_invokes(
+            response = self.breakers.call(
+                STATUS,
+                self.bedrock_runtime.list_async_invokes,
                 maxResults=max_results
             )
+            for job in response.get('asyncInvokes', []):
+                if self.accountant:
+                    self.accountant.observe_status(job['invocationArn'], job)
+                if self.job_store is not None:
+                    self.job_store.observe(job)
             return response
         except Exception as e:
             logger.error(f"❌ 获取任务列表失败: {str(e)}")
             raise
+    
+    def reconcile_in_flight(self) -> int:
+        """
+        按服务端进行中的任务校正用量统计器中的进行中任务
+        
+        提交后不再轮询的任务（例如参数扫描）不会被观察到结束状态，
+        定期调用此方法可避免配额预测把它们一直计为进行中。
+        
+        Returns:
+            移出进行中列表的任务数
+        """
+        if not self.accountant:
+            return 0
+        
+        as_of = self._clock()
+        in_progress = []
+        kwargs = {'statusEquals': 'InProgress', 'maxResults': 1000}
+        try:
+            while True:
+                response = self.breakers.call(
+                    STATUS,
+                    self.bedrock_runtime.list_async_invokes,
+                    **kwargs
+                )
+                in_progress.extend(job['invocationArn'] for job in response.get('asyncInvokes', []))
+                next_token = response.get('nextToken')
+                if not next_token:
+                    break
+                kwargs['nextToken'] = next_token
+        except Exception as e:
+            logger.error(f"❌ 校正进行中任务失败: {str(e)}")
+            raise
+        return self.accountant.reconcile(in_progress, as_of)
 
 
 # 便捷函数
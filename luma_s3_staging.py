@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Luma Ray2 关键帧S3暂存
+批量并行上传本地关键帧到S3，按内容哈希去重，并通过生命周期规则自动清理
+"""
+
+import os
+import base64
+import hashlib
+import logging
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, Iterable, Tuple
+from urllib.parse import urlparse
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from luma_circuit_breaker import DependencyBreakers, S3_GET, S3_PUT
+
+logger = logging.getLogger(__name__)
+
+# 默认暂存位置
+DEFAULT_STAGING_BUCKET = "s3-demo-zy"
+DEFAULT_STAGING_PREFIX = "temp_images/"
+
+# 关键帧通常只有几MB，单文件并发不宜过高，并行度主要来自多文件同时上传
+DEFAULT_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True
+)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_media_type(image_path: str) -> str:
+    """根据扩展名推断图片的media_type"""
+    ext = Path(image_path).suffix.lower()
+    if ext in ['.jpg', '.jpeg']:
+        return 'image/jpeg'
+    elif ext == '.png':
+        return 'image/png'
+    else:
+        return 'image/jpeg'  # 默认
+
+
+def _parse_s3_uri(s3_uri: str) -> Tuple[str, str]:
+    parsed = urlparse(s3_uri)
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+class KeyframeStager:
+    """
+    关键帧暂存器
+
+    Luma Ray2的keyframes目前只接受base64来源，无法直接引用S3对象，
+    因此暂存器同时缓存已编码的关键帧：同一张图片在多个任务中复用时
+    只读取/下载并编码一次。
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str = DEFAULT_STAGING_BUCKET,
+        prefix: str = DEFAULT_STAGING_PREFIX,
+        max_workers: int = 8,
+        transfer_config: Optional[TransferConfig] = None,
+        max_cache_bytes: int = 64 * 1024 * 1024,
+        breakers: Optional[DependencyBreakers] = None,
+        expire_days: int = 1
+    ):
+        """
+        初始化暂存器
+
+        Args:
+            s3_client: boto3 S3客户端
+            bucket: 暂存桶名
+            prefix: 暂存键前缀
+            max_workers: 批量上传时的并行文件数
+            transfer_config: S3传输配置，默认使用DEFAULT_TRANSFER_CONFIG
+            max_cache_bytes: 已编码关键帧缓存的最大字节数
+            breakers: 依赖熔断器（可选），S3读写分别经过s3_get、s3_put端点
+            expire_days: 暂存对象保留天数，与apply_lifecycle()设置的过期规则一致
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix if not prefix or prefix.endswith('/') else prefix + '/'
+        self.max_workers = max_workers
+        self.transfer_config = transfer_config or DEFAULT_TRANSFER_CONFIG
+        self.max_cache_bytes = max_cache_bytes
+        self.breakers = breakers
+        self.expire_days = expire_days
+        # 判断暂存对象是否临近过期使用的时钟，可通过set_clock()替换
+        self._clock = time.time
+
+        self._lock = threading.Lock()
+        # (路径, 修改时间, 大小) -> 内容哈希
+        self._hash_cache: Dict[Tuple[str, float, int], str] = {}
+        # 内容标识 -> 已编码的keyframe source，按LRU淘汰
+        self._source_cache: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._source_cache_bytes = 0
+
+    def set_clock(self, clock: Callable[[], float]):
+        """
+        替换判断暂存对象是否临近过期使用的时钟（例如回放时使用虚拟时钟）
+
+        Args:
+            clock: 时钟函数，返回epoch秒
+        """
+        self._clock = clock
+
+    def _call(self, endpoint: str, func: Callable, *args, **kwargs) -> Any:
+        if self.breakers:
+            return self.breakers.call(endpoint, func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    def content_hash(self, image_path: str) -> str:
+        """
+        计算本地文件的SHA-256，未修改的文件不会重复计算
+
+        Args:
+            image_path: 本地图片路径
+
+        Returns:
+            十六进制哈希值
+        """
+        stat = os.stat(image_path)
+        cache_key = (os.path.abspath(image_path), stat.st_mtime, stat.st_size)
+        with self._lock:
+            cached = self._hash_cache.get(cache_key)
+        if cached:
+            return cached
+
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+
+        with self._lock:
+            self._hash_cache[cache_key] = content_hash
+        return content_hash
+
+    def _head_object(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self._call(S3_GET, self.s3_client.head_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _needs_refresh(self, head: Dict[str, Any]) -> bool:
+        # 过期规则按创建时间计算，已存在超过保留期一半的对象在返回前刷新
+        last_modified = head.get('LastModified')
+        if not isinstance(last_modified, datetime):
+            return False
+        age = self._clock() - last_modified.timestamp()
+        return age >= self.expire_days * 86400 / 2
+
+    def _refresh(self, key: str, content_type: str):
+        # 原地复制会生成新对象，过期时间从复制时重新计算
+        self._call(
+            S3_PUT,
+            self.s3_client.copy_object,
+            Bucket=self.bucket,
+            Key=key,
+            CopySource={'Bucket': self.bucket, 'Key': key},
+            MetadataDirective='REPLACE',
+            ContentType=content_type
+        )
+
+    def stage(self, image_path: str) -> str:
+        """
+        上传单个本地图片，内容相同的文件已存在时跳过上传
+
+        已存在的对象临近过期时会先原地复制刷新创建时间，
+        避免返回的URI在使用前被生命周期规则删除。
+
+        Args:
+            image_path: 本地图片路径
+
+        Returns:
+            S3 URI
+        """
+        try:
+            key = f"{self.prefix}{self.content_hash(image_path)}{Path(image_path).suffix.lower()}"
+            s3_uri = f"s3://{self.bucket}/{key}"
+
+            head = self._head_object(key)
+            if head is not None:
+                if self._needs_refresh(head):
+                    self._refresh(key, get_media_type(image_path))
+                    logger.info(f"🔁 图片已存在，已刷新过期时间: {s3_uri}")
+                else:
+                    logger.info(f"⏭️  图片已存在，跳过上传: {s3_uri}")
+                return s3_uri
+
+            self._call(
+                S3_PUT,
+                self.s3_client.upload_file,
+                image_path,
+                self.bucket,
+                key,
+                ExtraArgs={'ContentType': get_media_type(image_path)},
+                Config=self.transfer_config
+            )
+            logger.info(f"📤 图片已上传到S3: {s3_uri}")
+            return s3_uri
+
+        except Exception as e:
+            logger.error(f"❌ 图片上传失败 {image_path}: {str(e)}")
+            raise
+
+    def stage_many(
+        self,
+        image_paths: Iterable[str]
+    ) -> Tuple[Dict[str, str], Dict[str, Exception]]:
+        """
+        并行上传多个本地图片，单个文件失败不影响其他文件
+
+        Args:
+            image_paths: 本地图片路径列表
+
+        Returns:
+            ({本地路径: S3 URI}, {本地路径: 异常})，重复的路径只上传一次
+        """
+        unique_paths = list(dict.fromkeys(image_paths))
+        staged: Dict[str, str] = {}
+        failed: Dict[str, Exception] = {}
+        if not unique_paths:
+            return staged, failed
+
+        logger.info(f"📦 批量暂存 {len(unique_paths)} 张图片到 s3://{self.bucket}/{self.prefix}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(path, executor.submit(self.stage, path)) for path in unique_paths]
+            for path, future in futures:
+                error = future.exception()
+                if error is not None:
+                    failed[path] = error
+                else:
+                    staged[path] = future.result()
+
+        if failed:
+            logger.warning(f"⚠️  {len(failed)}/{len(unique_paths)} 张图片暂存失败")
+        return staged, failed
+
+    def apply_lifecycle(self, expire_days: Optional[int] = None):
+        """
+        为暂存前缀设置过期规则，保留桶上已有的其他生命周期规则
+
+        Args:
+            expire_days: 暂存对象保留天数，默认使用构造时的expire_days
+        """
+        if expire_days is not None:
+            self.expire_days = expire_days
+        expire_days = self.expire_days
+        rule_id = f"luma-keyframe-staging-{self.prefix.strip('/') or 'root'}"
+        try:
+            existing = self._call(
+                S3_GET, self.s3_client.get_bucket_lifecycle_configuration, Bucket=self.bucket
+            ).get('Rules', [])
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchLifecycleConfiguration':
+                raise
+            existing = []
+
+        rules = [rule for rule in existing if rule.get('ID') != rule_id]
+        rules.append({
+            'ID': rule_id,
+            'Filter': {'Prefix': self.prefix},
+            'Status': 'Enabled',
+            'Expiration': {'Days': expire_days},
+            'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 1},
+        })
+
+        self._call(
+            S3_PUT,
+            self.s3_client.put_bucket_lifecycle_configuration,
+            Bucket=self.bucket,
+            LifecycleConfiguration={'Rules': rules}
+        )
+        logger.info(f"🧹 已设置暂存图片过期规则: s3://{self.bucket}/{self.prefix} ({expire_days}天)")
+
+    def _cache_get(self, cache_key: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            source = self._source_cache.get(cache_key)
+            if source is not None:
+                self._source_cache.move_to_end(cache_key)
+            return source
+
+    def _cache_put(self, cache_key: str, source: Dict[str, str]):
+        size = len(source['data'])
+        if size > self.max_cache_bytes:
+            return
+        with self._lock:
+            if cache_key in self._source_cache:
+                return
+            self._source_cache[cache_key] = source
+            self._source_cache_bytes += size
+            while self._source_cache_bytes > self.max_cache_bytes:
+                _, evicted = self._source_cache.popitem(last=False)
+                self._source_cache_bytes -= len(evicted['data'])
+
+    def keyframe_source(self, image_path_or_uri: str) -> Dict[str, str]:
+        """
+        构建keyframe的source字段（本地文件或S3路径）
+
+        Args:
+            image_path_or_uri: 本地图片路径或S3 URI
+
+        Returns:
+            {"type": "base64", "media_type": ..., "data": ...}
+        """
+        if image_path_or_uri.startswith('s3://'):
+            bucket, key = _parse_s3_uri(image_path_or_uri)
+            # 以ETag区分同一键上的不同内容
+            etag = self._call(S3_GET, self.s3_client.head_object, Bucket=bucket, Key=key)['ETag']
+            cache_key = f"{image_path_or_uri}#{etag}"
+            source = self._cache_get(cache_key)
+            if source is None:
+                # 直接读入内存，不经过临时文件
+                image_data = self._call(
+                    S3_GET, lambda: self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+                )
+        else:
+            cache_key = self.content_hash(image_path_or_uri)
+            source = self._cache_get(cache_key)
+            if source is None:
+                with open(image_path_or_uri, 'rb') as f:
+                    image_data = f.read()
+
+        if source is None:
+            source = {
+                "type": "base64",
+                "media_type": get_media_type(image_path_or_uri),
+                "data": base64.b64encode(image_data).decode('utf-8')
+            }
+            self._cache_put(cache_key, source)
+        return dict(source)
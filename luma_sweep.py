@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Luma Ray2 提示模板与参数扫描
+将紧凑的扫描描述展开为惰性生成的model_input序列，并发提交前可先估算费用
+"""
+
+import hashlib
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from string import Formatter
+from typing import Optional, Dict, Any, Iterator, Sequence, Tuple, Union
+
+from luma_accounting import DEFAULT_PRICE_PER_SECOND, billable_seconds
+from luma_circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# 模型支持的参数取值
+ASPECT_RATIOS = ("1:1", "16:9", "9:16", "4:3", "3:4", "21:9", "9:21")
+DURATIONS = ("5s", "9s")
+RESOLUTIONS = ("540p", "720p")
+
+
+# 提示文本长度限制
+MAX_PROMPT_LENGTH = 5000
+
+# 提交熔断时两次重试之间的最短等待（半开状态下探测名额已满时retry_after为0）
+_MIN_BACKOFF_SECONDS = 1.0
+
+
+def _normalize_text(text: str) -> str:
+    """合并行内连续空白并去掉首尾空白，保留换行，避免仅空白不同的提示被当作不同组合"""
+    lines = str(text).strip().splitlines()
+    return "\n".join(" ".join(line.split()) for line in lines)
+
+
+def _prompt_error(prompt: str) -> Optional[str]:
+    """提示文本不合法时返回错误信息"""
+    if not (1 <= len(prompt) <= MAX_PROMPT_LENGTH):
+        return f"提示文本长度必须在1-{MAX_PROMPT_LENGTH}字符之间（实际 {len(prompt)}）: {prompt[:50]}..."
+    return None
+
+
+def _unique(values: Sequence[Any]) -> Tuple[Any, ...]:
+    """保持顺序去重"""
+    return tuple(dict.fromkeys(values))
+
+
+def _validated(name: str, values: Sequence[Any], allowed: Sequence[Any]) -> Tuple[Any, ...]:
+    values = _unique(values)
+    if not values:
+        raise ValueError(f"{name} 至少需要一个取值")
+    invalid = [v for v in values if v not in allowed]
+    if invalid:
+        raise ValueError(f"不支持的{name}: {invalid}，可选值: {list(allowed)}")
+    return values
+
+
+class SweepSpec:
+    """
+    参数扫描描述
+
+    模板使用str.format风格的占位符，例如 "A {animal} running on {place}"，
+    variables给出每个占位符的候选值。展开结果是模板变量与宽高比、时长、
+    分辨率、循环播放的笛卡尔积。
+
+    渲染后的提示会规范化空白，并按哈希去重（不同模板或不同变量取值
+    渲染出相同提示时只保留一次）；宽高比等参数维度本身已去重，
+    因此去重集合只随不同提示数增长，与参数组合总数无关。
+    长度不合法的提示仍会生成，由submit_sweep作为单项失败返回。
+    """
+
+    def __init__(
+        self,
+        templates: Union[str, Sequence[str]],
+        variables: Optional[Dict[str, Sequence[str]]] = None,
+        aspect_ratios: Sequence[str] = ("16:9",),
+        durations: Sequence[str] = ("5s",),
+        resolutions: Sequence[str] = ("720p",),
+        loops: Sequence[bool] = (False,)
+    ):
+        """
+        初始化扫描描述
+
+        Args:
+            templates: 提示模板或模板列表（提示变体）
+            variables: 占位符名 -> 候选值列表
+            aspect_ratios: 宽高比列表
+            durations: 视频时长列表
+            resolutions: 分辨率列表
+            loops: 是否循环播放的取值列表
+        """
+        if isinstance(templates, str):
+            templates = [templates]
+        # 模板保持原样（包括换行），渲染后的提示统一规范化
+        self.templates = _unique(templates)
+        if not self.templates:
+            raise ValueError("至少需要一个提示模板")
+
+        self.variables = {
+            name: _unique(_normalize_text(v) for v in values)
+            for name, values in (variables or {}).items()
+        }
+        self.aspect_ratios = _validated("宽高比", aspect_ratios, ASPECT_RATIOS)
+        self.durations = _validated("时长", durations, DURATIONS)
+        self.resolutions = _validated("分辨率", resolutions, RESOLUTIONS)
+        self.loops = _validated("循环播放", [bool(v) for v in loops], (False, True))
+
+        # 每个模板实际引用的变量
+        self._template_fields = [self._fields(t) for t in self.templates]
+
+        self._prompt_stats: Optional[Tuple[int, int]] = None
+
+        referenced = set(itertools.chain.from_iterable(self._template_fields))
+        unused = set(self.variables) - referenced
+        if unused:
+            logger.warning(f"⚠️  以下变量未被任何模板引用，已忽略: {sorted(unused)}")
+
+    def _fields(self, template: str) -> Tuple[str, ...]:
+        fields = []
+        for _, field_name, _, _ in Formatter().parse(template):
+            if field_name is None:
+                continue
+            if not field_name.isidentifier():
+                raise ValueError(f"模板占位符必须是变量名: {{{field_name}}}")
+            if field_name not in self.variables:
+                raise ValueError(f"模板引用了未定义的变量: {field_name}")
+            if not self.variables[field_name]:
+                raise ValueError(f"变量 {field_name} 没有候选值")
+            fields.append(field_name)
+        return _unique(fields)
+
+    def _count_prompts(self) -> Tuple[int, int]:
+        """(不同提示数, 其中长度不合法的提示数)，只遍历提示，不展开参数组合"""
+        if self._prompt_stats is None:
+            total = invalid = 0
+            for prompt in self.prompts():
+                total += 1
+                if _prompt_error(prompt):
+                    invalid += 1
+            self._prompt_stats = (total, invalid)
+        return self._prompt_stats
+
+    def prompt_count(self) -> int:
+        """展开后的不同提示数量"""
+        return self._count_prompts()[0]
+
+    def _settings_per_prompt(self) -> int:
+        return (
+            len(self.aspect_ratios)
+            * len(self.durations)
+            * len(self.resolutions)
+            * len(self.loops)
+        )
+
+    def __len__(self) -> int:
+        """展开后的请求总数（只遍历提示，不展开参数组合）"""
+        return self.prompt_count() * self._settings_per_prompt()
+
+    def prompts(self) -> Iterator[str]:
+        """惰性生成所有不同的规范化提示文本"""
+        seen = set()
+        for template, fields in zip(self.templates, self._template_fields):
+            for values in itertools.product(*(self.variables[name] for name in fields)):
+                prompt = _normalize_text(template.format(**dict(zip(fields, values))))
+                digest = hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                yield prompt
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """
+        惰性生成规范化的model_input
+
+        Yields:
+            与text_to_video参数对应的model_input字典
+        """
+        for prompt in self.prompts():
+            for aspect_ratio, duration, resolution, loop in itertools.product(
+                self.aspect_ratios, self.durations, self.resolutions, self.loops
+            ):
+                yield {
+                    "prompt": prompt,
+                    "aspect_ratio": aspect_ratio,
+                    "duration": duration,
+                    "resolution": resolution,
+                    "loop": loop
+                }
+
+    def estimate_cost(self, price_per_second: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        启动前估算整个扫描的计费秒数和费用（只遍历去重后的提示，不展开参数组合）
+
+        长度不合法的提示不会被提交，不计入费用，单独列在invalid_jobs中。
+
+        Args:
+            price_per_second: 各分辨率每秒视频单价，默认使用DEFAULT_PRICE_PER_SECOND
+
+        Returns:
+            {"jobs", "invalid_jobs", "billable_seconds", "cost", "breakdown"}，
+            breakdown按"时长/分辨率"细分
+        """
+        prices = price_per_second or DEFAULT_PRICE_PER_SECOND
+        total, invalid = self._count_prompts()
+        jobs_per_setting = (total - invalid) * len(self.aspect_ratios) * len(self.loops)
+
+        estimate = {
+            "jobs": 0,
+            "invalid_jobs": invalid * self._settings_per_prompt(),
+            "billable_seconds": 0,
+            "cost": 0.0,
+            "breakdown": {},
+        }
+        for duration, resolution in itertools.product(self.durations, self.resolutions):
+            seconds = jobs_per_setting * billable_seconds(duration)
+            cost = seconds * prices.get(resolution, 0.0)
+            estimate["breakdown"][f"{duration}/{resolution}"] = {
+                "jobs": jobs_per_setting,
+                "billable_seconds": seconds,
+                "cost": cost,
+            }
+            estimate["jobs"] += jobs_per_setting
+            estimate["billable_seconds"] += seconds
+            estimate["cost"] += cost
+        return estimate
+
+
+def _submit_with_backpressure(
+    client,
+    model_input: Dict[str, Any],
+    s3_output_uri: str,
+    team: Optional[str],
+    max_backoff: float
+) -> str:
+    """
+    提交单个请求，提交端点熔断时等待后重试同一请求
+
+    Raises:
+        CircuitOpenError: 累计等待超过max_backoff秒后仍处于熔断
+    """
+    deadline = client.now() + max_backoff
+    while True:
+        try:
+            return client.text_to_video(s3_output_uri=s3_output_uri, team=team, **model_input)
+        except CircuitOpenError as e:
+            delay = max(e.retry_after, _MIN_BACKOFF_SECONDS)
+            if client.now() + delay > deadline:
+                raise
+            logger.warning(f"⏸️  提交熔断中，{delay:.1f}秒后重试: {model_input['prompt'][:50]}")
+            client.sleep(delay)
+
+
+def submit_sweep(
+    client,
+    requests: Iterator[Dict[str, Any]],
+    s3_output_uri: str,
+    max_in_flight: int = 8,
+    team: Optional[str] = None,
+    max_backoff: float = 600
+) -> Iterator[Tuple[Dict[str, Any], Optional[str], Optional[Exception]]]:
+    """
+    并发提交扫描请求
+
+    只从requests中预取max_in_flight个请求，完成一个再补充一个，
+    因此任意规模的扫描都以固定内存提交。单个请求失败（包括提示长度
+    不合法，此时不会调用服务）不会中断整个扫描；requests本身抛出异常时，
+    先返回已提交请求的结果再抛出，不会丢失已创建任务的ARN。
+
+    提交端点熔断（CircuitOpenError）视为背压：工作线程等待retry_after后
+    重试同一请求，期间不从requests中取新请求，超过max_backoff才作为失败返回。
+
+    Args:
+        client: LumaRay2Client实例
+        requests: model_input序列（例如SweepSpec）
+        s3_output_uri: S3输出路径
+        max_in_flight: 同时进行中的提交请求数
+        team: 提交任务的团队（可选，用于用量统计）
+        max_backoff: 单个请求因熔断累计等待的最长时间（秒）
+
+    Yields:
+        (model_input, 任务ARN, 异常)，提交成功时异常为None，失败时ARN为None
+    """
+    requests = iter(requests)
+    pending = {}
+    exhausted = False
+    source_error = None
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while True:
+            # 补充到max_in_flight个进行中的请求
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    model_input = next(requests)
+                except StopIteration:
+                    exhausted = True
+                    break
+                except Exception as e:
+                    logger.error(f"❌ 扫描请求生成失败: {str(e)}")
+                    exhausted = True
+                    source_error = e
+                    break
+
+                message = _prompt_error(model_input.get("prompt", ""))
+                if message:
+                    logger.error(f"❌ 扫描请求不合法: {message}")
+                    yield model_input, None, ValueError(message)
+                    continue
+
+                future = executor.submit(
+                    _submit_with_backpressure,
+                    client,
+                    model_input,
+                    s3_output_uri,
+                    team,
+                    max_backoff
+                )
+                pending[future] = model_input
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                model_input = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    logger.error(f"❌ 扫描请求提交失败: {str(error)}")
+                    yield model_input, None, error
+                else:
+                    yield model_input, future.result(), None
+
+    if source_error is not None:
+        raise source_error